@@ -1,28 +1,174 @@
-from fastapi import FastAPI, Form, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+import json
+import shutil
 import subprocess
-from pydantic import BaseModel
+import sys
+from pydantic import BaseModel, Field
 import os
 import queue
 import asyncio
-from jupyter_client import KernelManager
-import nbformat
-from nbformat.v4 import new_notebook
+import contextlib
+import functools
+import logging
+import re
+import sysconfig
+import zipfile
+import zlib
+import importlib.metadata
+from jupyter_client.asynchronous import AsyncKernelClient
+from jupyter_client.manager import AsyncKernelManager
 import time
-from typing import Dict, Optional, List
+import zmq
+import zmq.asyncio
+from typing import Any, AsyncIterator, Dict, Optional, List, Set
+
+# Upper bound for a decompressed request body, so a small gzip bomb can't exhaust memory
+MAX_DECOMPRESSED_BODY_SIZE = 16 * 1024 * 1024 # bytes
+
+# Request bodies sent with Content-Encoding: gzip are decompressed before FastAPI parses them
+class GzipRequest(Request):
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) # Expect a gzip header and trailer
+                try:
+                    # One byte over the limit is enough to tell that the body is too large
+                    body = decompressor.decompress(body, MAX_DECOMPRESSED_BODY_SIZE + 1)
+                except zlib.error as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid gzip request body: {e}")
+                if len(body) > MAX_DECOMPRESSED_BODY_SIZE:
+                    raise HTTPException(status_code=413, detail=f"Decompressed request body exceeds {MAX_DECOMPRESSED_BODY_SIZE} bytes")
+                if not decompressor.eof:
+                    raise HTTPException(status_code=400, detail="Invalid gzip request body: truncated stream")
+            self._body = body
+        return self._body
+
+class GzipRoute(APIRoute):
+    def get_route_handler(self):
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            return await original_route_handler(GzipRequest(request.scope, request.receive))
+
+        return route_handler
 
 # FastAPI instance
 app = FastAPI()
+app.router.route_class = GzipRoute # Must be set before any route is declared
+# Compress larger responses for clients that accept gzip; streamed NDJSON output is left alone so chunks aren't held back
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1, exclude_content_types=("text/event-stream", "application/x-ndjson"))
+
+# Module logger; configured in startup_event
+logger = logging.getLogger(__name__)
 
 # Base folders
 BASE_FOLDER = "/mnt/data"
 SESSIONS_FOLDER = "/mnt/jupyter_sessions"
 
+# Kernel setup code: imports the precompiled sandbox_setup module (pandas, numpy, matplotlib, os)
+SETUP_CODE = "from sandbox_setup import *"
+
+# Execution timing: overall deadline per execution and the short poll used to notice dead kernels
+DEFAULT_EXECUTION_TIMEOUT = 60 # seconds
+KERNEL_POLL_INTERVAL = 0.5 # seconds
+
+# Sessions without any interaction for this long are cleaned up
+SESSION_INACTIVITY_TIMEOUT = 3600 # seconds
+
+# A removed session's kernel is cleaned up once its in-flight request finishes, or after this long regardless
+SESSION_CLEANUP_GRACE = DEFAULT_EXECUTION_TIMEOUT # seconds
+
+# Package installer: uv's parallel resolver/installer when available, pip otherwise
+if shutil.which("uv"):
+    PIP_INSTALL_COMMAND = ["uv", "pip", "install", "--python", sys.executable]
+else:
+    PIP_INSTALL_COMMAND = [sys.executable, "-m", "pip", "install"]
+
+# Optional read-only directory of pre-built wheels; pure-Python hits are unpacked in-process instead of running pip
+WHEEL_CACHE = "/opt/wheelhouse"
+
+class IOPubDispatcher:
+    """Reads the iopub sockets of all kernels from one coroutine and routes messages to per-request inboxes."""
+    def __init__(self):
+        self._poller = zmq.asyncio.Poller()
+        self._sockets: Dict[zmq.asyncio.Socket, AsyncKernelClient] = {} # iopub socket -> owning client
+        self._inboxes: Dict[str, asyncio.Queue] = {} # request msg_id -> queue of its iopub messages
+        self._sockets_changed = asyncio.Event() # Wakes the poll loop when sockets are (un)registered
+
+    def register(self, kernel_client: AsyncKernelClient):
+        """Start polling the client's iopub socket."""
+        socket = kernel_client.iopub_channel.socket
+        if socket not in self._sockets:
+            self._sockets[socket] = kernel_client
+            self._poller.register(socket, zmq.POLLIN)
+            self._sockets_changed.set()
+
+    def unregister(self, kernel_client: AsyncKernelClient):
+        """Stop polling the client's iopub socket. Must be called before its channels are stopped."""
+        socket = kernel_client.iopub_channel.socket
+        if self._sockets.pop(socket, None) is not None:
+            self._poller.unregister(socket)
+            self._sockets_changed.set()
+
+    def open_inbox(self, msg_id: str) -> asyncio.Queue:
+        """Create the queue receiving iopub messages whose parent is the given request."""
+        inbox = asyncio.Queue()
+        self._inboxes[msg_id] = inbox
+        return inbox
+
+    def close_inbox(self, msg_id: str):
+        """Drop the inbox of a finished request; later messages for it are discarded."""
+        self._inboxes.pop(msg_id, None)
+
+    async def run(self):
+        """Poll all registered sockets forever, restarting the poll whenever the socket set changes."""
+        while True:
+            self._sockets_changed.clear()
+            poll = asyncio.ensure_future(self._poller.poll())
+            changed = asyncio.ensure_future(self._sockets_changed.wait())
+            await asyncio.wait({poll, changed}, return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            if not poll.done():
+                poll.cancel()
+                continue
+            if poll.cancelled():
+                continue # A socket was closed mid-poll by a concurrent cleanup; poll the remaining ones again
+            if poll.exception() is not None:
+                logger.error("Error polling iopub sockets: %s", poll.exception())
+                continue
+
+            for socket, _ in poll.result():
+                try:
+                    # Drain everything already queued on this socket before polling again
+                    while socket in self._sockets and socket.get(zmq.EVENTS) & zmq.POLLIN:
+                        frames = await socket.recv_multipart()
+                        self._route(self._sockets.get(socket), frames)
+                except Exception as e:
+                    # Socket may have been closed by a concurrent cleanup; keep serving the others
+                    logger.error("Error reading iopub socket: %s", e)
+
+    def _route(self, kernel_client: Optional[AsyncKernelClient], frames):
+        """Deserialize one message and deliver it to the inbox of its parent request, if any."""
+        if kernel_client is None:
+            return # Socket was unregistered while the message was being received
+        _, msg_frames = kernel_client.session.feed_identities(frames)
+        msg = kernel_client.session.deserialize(msg_frames)
+        inbox = self._inboxes.get(msg['parent_header'].get('msg_id'))
+        if inbox is not None:
+            inbox.put_nowait(msg)
+
+# Process-wide dispatcher shared by all controllers
+IOPUB_DISPATCHER = IOPubDispatcher()
+
 class JupyterController:
     def __init__(self, folder_path):
         self.folder_path = folder_path
-        self.notebook_path = None
-        self.kernel_manager = None
-        self.kernel_client = None
+        self.kernel_manager: Optional[AsyncKernelManager] = None
+        self.kernel_client: Optional[AsyncKernelClient] = None
         self._kernel_ready = False
 
     async def _wait_for_kernel_ready(self, timeout=30):
@@ -33,60 +179,45 @@ class JupyterController:
                 raise TimeoutError("Kernel failed to start within timeout period")
 
             try:
-                if self.kernel_manager and self.kernel_manager.is_alive():
-                    # Try a test execution to confirm readiness
-                    self.kernel_client.execute("1+1")
-                    # Clear out all messages from the test execution
-                    while True:
-                        try:
-                            msg = self.kernel_client.get_iopub_msg(timeout=0.1)
-                            if msg['header']['msg_type'] == 'status' and \
-                               msg['content']['execution_state'] == 'idle':
-                                break
-                        except queue.Empty:
-                            break
+                if self.kernel_manager and await self.kernel_manager.is_alive():
+                    # A kernel_info_reply on the shell channel confirms readiness without executing code
+                    msg_id = self.kernel_client.kernel_info()
+                    remaining = max(0.0, timeout - (time.time() - start_time))
+                    await self._get_shell_reply(msg_id, asyncio.get_running_loop().time() + remaining)
 
                     self._kernel_ready = True
                     break
             except Exception as e:
                 # Log potential errors during kernel readiness check
-                print(f"Kernel init check error: {str(e)}")
+                logger.debug("Kernel init check error: %s", e)
                 pass # Allow loop to continue or timeout
 
             await asyncio.sleep(0.1)
 
-    async def create_notebook(self, notebook_name):
-        """Create notebook file and initialize kernel manager/client."""
-        os.makedirs(self.folder_path, exist_ok=True)
-        self.notebook_path = os.path.join(self.folder_path, f"{notebook_name}.ipynb")
-
-        nb = new_notebook()
-        with open(self.notebook_path, "w") as f:
-            nbformat.write(nb, f)
-
-        self.kernel_manager = KernelManager()
-        self.kernel_manager.start_kernel()
+    async def start_kernel(self):
+        """Initialize kernel manager/client and wait for the kernel to become ready."""
+        self.kernel_manager = AsyncKernelManager()
+        await self.kernel_manager.start_kernel()
         self.kernel_client = self.kernel_manager.client()
         self.kernel_client.start_channels()
+        # iopub is read by the shared dispatcher; messages nobody waits for are dropped there
+        IOPUB_DISPATCHER.register(self.kernel_client)
 
         # Wait for kernel to be properly initialized
         await self._wait_for_kernel_ready()
 
-        # Clear any remaining messages in the queue from startup
-        self._clear_output_queue()
-
-        return self.notebook_path
+    def rebind(self, folder_path):
+        """Assign a pre-warmed controller to the given session folder."""
+        # Nothing is written per session any more, so the folder is not created here
+        self.folder_path = folder_path
 
-    def _clear_output_queue(self):
-        """Clear any pending messages in the kernel's iopub queue."""
-        while True:
-            try:
-                self.kernel_client.get_iopub_msg(timeout=0.1)
-            except queue.Empty:
-                break
+    async def execute_code(self, code, timeout=DEFAULT_EXECUTION_TIMEOUT):
+        """Execute code in the kernel within an overall deadline of `timeout` seconds, handling outputs and errors."""
+        outputs = [chunk async for chunk in self.execute_code_stream(code, timeout)]
+        return '\n'.join(outputs).strip() if outputs else ""
 
-    async def execute_code(self, code):
-        """Execute code in the kernel, handling outputs and errors."""
+    async def execute_code_stream(self, code, timeout=DEFAULT_EXECUTION_TIMEOUT) -> AsyncIterator[str]:
+        """Execute code in the kernel, yielding each output chunk as it arrives; raises like execute_code once done."""
         if not self._kernel_ready:
             # Try waiting again briefly in case of race condition before failing
             try:
@@ -97,111 +228,139 @@ class JupyterController:
                  raise RuntimeError("Kernel not ready after waiting. Please restart session.")
 
 
-        if not self.kernel_manager.is_alive():
+        if not await self.kernel_manager.is_alive():
             self._kernel_ready = False
             raise RuntimeError("Kernel died. Please restart session.")
 
-        # Clear any pending messages before execution
-        self._clear_output_queue()
-
+        deadline = asyncio.get_running_loop().time() + timeout
         msg_id = self.kernel_client.execute(code)
-        outputs = []
-        error_encountered = False
+        # Opened before yielding to the loop, so none of this request's messages can be missed
+        inbox = IOPUB_DISPATCHER.open_inbox(msg_id)
+        try:
+            async for chunk in self._collect_execution(msg_id, inbox, deadline):
+                yield chunk
+        finally:
+            IOPUB_DISPATCHER.close_inbox(msg_id)
+
+    async def _collect_execution(self, msg_id, inbox, deadline) -> AsyncIterator[str]:
+        """Yield the outputs of one execution from its inbox and raise on errors or timeouts."""
+        loop = asyncio.get_running_loop()
+        error_detail = None
 
         while True:
             try:
-                # Increased timeout for potentially longer operations
-                msg = self.kernel_client.get_iopub_msg(timeout=20)
+                # Poll briefly so a dead kernel is noticed long before the deadline
+                remaining = max(0.0, deadline - loop.time())
+                msg = await asyncio.wait_for(inbox.get(), timeout=min(KERNEL_POLL_INTERVAL, remaining))
                 msg_type = msg['header']['msg_type']
                 content = msg['content']
 
                 if msg_type == 'stream':
-                    outputs.append(content['text'])
+                    yield content['text']
                 elif msg_type == 'execute_result':
-                    outputs.append(str(content['data'].get('text/plain', '')))
+                    yield str(content['data'].get('text/plain', ''))
                 elif msg_type == 'display_data':
                     # Handle different data types, omitting complex ones for brevity
                     if 'image/png' in content['data']:
-                         outputs.append(f"[Image data: base64 PNG omitted]")
+                         yield "[Image data: base64 PNG omitted]"
                     elif 'text/html' in content['data']:
-                         outputs.append(f"[HTML data omitted]")
+                         yield "[HTML data omitted]"
                     else:
                         text_data = content['data'].get('text/plain', '')
                         if text_data:
-                            outputs.append(str(text_data))
+                            yield str(text_data)
                 elif msg_type == 'error':
-                    error_encountered = True
-                    # Return error details in a structured way
-                    error_detail = {
-                        "error": "Execution error",
-                        "ename": content.get('ename', 'UnknownError'),
-                        "evalue": content.get('evalue', 'Unknown error value'),
-                        "traceback": content.get('traceback', [])
-                    }
-                    # Raise HTTPException to be caught by FastAPI
-                    raise HTTPException(
-                        status_code=400, # Bad Request due to code error
-                        detail=error_detail
-                    )
+                    # Keep error details; they are raised once the kernel has finished this request
+                    error_detail = self._error_detail(content)
                 elif msg_type == 'status' and content['execution_state'] == 'idle':
-                    # Check if this idle status corresponds to our execution request
-                    if msg['parent_header']['msg_id'] == msg_id:
-                        break # Exit loop once our execution is idle
-
-            except queue.Empty:
-                # Check if kernel is still alive before declaring timeout
-                if not self.kernel_manager.is_alive():
-                     self._kernel_ready = False
-                     raise RuntimeError("Kernel died during execution. Please restart session.")
-                else:
-                    raise HTTPException(
-                        status_code=408, # Request Timeout
-                        detail="Code execution timed out waiting for response from kernel."
-                    )
+                    break # Exit loop once our execution is idle, all its output has been published
+
+            except asyncio.TimeoutError:
+                await self._check_execution_deadline(deadline)
             except Exception as e:
                  # Catch unexpected errors during message handling
-                 print(f"Error processing kernel message: {e}")
+                 logger.error("Error processing kernel message: %s", e)
                  raise HTTPException(status_code=500, detail=f"Internal error processing kernel output: {str(e)}")
 
+        # The execute_reply on the shell channel is the definitive completion signal
+        reply = await self._get_shell_reply(msg_id, deadline)
 
-        return '\n'.join(outputs).strip() if outputs else ""
+        if error_detail is None and reply['content'].get('status') == 'error':
+            error_detail = self._error_detail(reply['content'])
+        if error_detail is not None:
+            # Raise HTTPException to be caught by FastAPI
+            raise HTTPException(
+                status_code=400, # Bad Request due to code error
+                detail=error_detail
+            )
+
+    async def _get_shell_reply(self, msg_id, deadline):
+        """Wait for the shell reply to the given request, discarding replies to earlier requests; callers hold the session's exec_lock."""
+        loop = asyncio.get_running_loop()
+        # The reply normally follows the idle status closely, so allow at least one poll interval for it
+        deadline = max(deadline, loop.time() + KERNEL_POLL_INTERVAL)
+        while True:
+            try:
+                remaining = max(0.0, deadline - loop.time())
+                reply = await self.kernel_client.get_shell_msg(timeout=min(KERNEL_POLL_INTERVAL, remaining))
+            except (queue.Empty, asyncio.TimeoutError):
+                await self._check_execution_deadline(deadline)
+                continue
+            if reply['parent_header'].get('msg_id') == msg_id:
+                return reply
+
+    async def _check_execution_deadline(self, deadline):
+        """Raise if the kernel died or the execution deadline has passed; return to keep polling otherwise."""
+        if not await self.kernel_manager.is_alive():
+            self._kernel_ready = False
+            raise RuntimeError("Kernel died during execution. Please restart session.")
+        if asyncio.get_running_loop().time() >= deadline:
+            raise HTTPException(
+                status_code=408, # Request Timeout
+                detail="Code execution timed out waiting for response from kernel."
+            )
+
+    @staticmethod
+    def _error_detail(content):
+        """Return error details from an error message or reply in a structured way."""
+        return {
+            "error": "Execution error",
+            "ename": content.get('ename', 'UnknownError'),
+            "evalue": content.get('evalue', 'Unknown error value'),
+            "traceback": content.get('traceback', [])
+        }
 
     async def reset_kernel(self):
         """Restart the kernel and wait for it to become ready."""
         if self.kernel_manager:
-            print(f"Resetting kernel for session associated with: {self.folder_path}")
+            logger.info("Resetting kernel for session associated with: %s", self.folder_path)
             self._kernel_ready = False
             try:
-                self.kernel_manager.restart_kernel()
+                await self.kernel_manager.restart_kernel()
                 await self._wait_for_kernel_ready()
-                self._clear_output_queue()
-                print(f"Kernel reset successful for: {self.folder_path}")
+                logger.info("Kernel reset successful for: %s", self.folder_path)
             except Exception as e:
-                print(f"Error during kernel reset for {self.folder_path}: {e}")
+                logger.error("Error during kernel reset for %s: %s", self.folder_path, e)
                 # Attempt cleanup if reset fails badly
-                self.cleanup()
+                await self.cleanup()
                 raise RuntimeError(f"Failed to reset kernel: {e}")
 
 
-    def cleanup(self):
-        """Stop channels, shutdown kernel, and remove notebook file."""
-        print(f"Cleaning up resources for session associated with: {self.folder_path}")
+    async def cleanup(self):
+        """Stop channels and shutdown kernel."""
+        logger.info("Cleaning up resources for session associated with: %s", self.folder_path)
         if self.kernel_client:
             try:
+                IOPUB_DISPATCHER.unregister(self.kernel_client)
                 self.kernel_client.stop_channels()
             except Exception as e:
-                print(f"Error stopping channels: {e}")
+                logger.error("Error stopping channels: %s", e)
         if self.kernel_manager:
             try:
-                if self.kernel_manager.is_alive():
-                    self.kernel_manager.shutdown_kernel(now=True)
+                if await self.kernel_manager.is_alive():
+                    await self.kernel_manager.shutdown_kernel(now=True)
             except Exception as e:
-                print(f"Error shutting down kernel: {e}")
-        if self.notebook_path and os.path.exists(self.notebook_path):
-            try:
-                os.remove(self.notebook_path)
-            except Exception as e:
-                print(f"Error removing notebook file {self.notebook_path}: {e}")
+                logger.error("Error shutting down kernel: %s", e)
 
 
 # In-memory session tracking
@@ -211,6 +370,9 @@ class SessionInfo:
         self.controller = controller # The JupyterController instance for this session
         self.created_at = created_at # Timestamp when the session was created
         self.last_activity = created_at # Timestamp of the last interaction
+        self._eviction_handle = None # Pending inactivity timer (asyncio.TimerHandle)
+        self.installed: Set[str] = set() # Dependencies already installed and imported in this session
+        self.exec_lock = asyncio.Lock() # The kernel runs one cell at a time; requests for this session queue here
 
 # Dictionary to store active sessions, mapping conversation_id to SessionInfo
 sessions: Dict[str, SessionInfo] = {}
@@ -220,116 +382,308 @@ class RunRequest(BaseModel):
     conversation_id: str
     code: str
     dependencies: Optional[List[str]] = [] # Optional list of pip package names
+    timeout: float = Field(default=DEFAULT_EXECUTION_TIMEOUT, gt=0) # Overall execution deadline in seconds
+
+# Pydantic model for the /run endpoint response body; lets FastAPI serialize straight to JSON bytes via pydantic-core
+class RunResponse(BaseModel):
+    output: str
+
+# Pydantic model for the /reset and /end_session request bodies
+class SessionRequest(BaseModel):
+    conversation_id: str
+
+# Pydantic models for the /run_batch endpoint: several independent snippets for one session in a single request
+class RunBatchItem(BaseModel):
+    code: str
+    dependencies: Optional[List[str]] = [] # Optional list of pip package names
+
+class RunBatchRequest(BaseModel):
+    conversation_id: str
+    items: List[RunBatchItem]
+    timeout: float = Field(default=DEFAULT_EXECUTION_TIMEOUT, gt=0) # Execution deadline per item in seconds
+
+class RunBatchResult(BaseModel):
+    status_code: int # What /run would have answered for this item on its own
+    output: Optional[str] = None # Set on success
+    detail: Optional[Any] = None # Set on failure, same shape as /run's error detail
+
+class RunBatchResponse(BaseModel):
+    results: List[RunBatchResult]
+
+# Pre-warmed kernel pool
+KERNEL_POOL_SIZE = 4 # Number of warm controllers kept ready for new sessions
+KERNEL_POOL_TIMEOUT = 5 # Seconds to wait for a warm controller before cold-starting one
+KERNEL_POOL: "asyncio.Queue[JupyterController]" = asyncio.Queue(maxsize=KERNEL_POOL_SIZE)
+
+# Internal Helper Function
+async def _make_warm_controller() -> JupyterController:
+    """Starts a kernel in the pool folder and runs the initial setup code in it."""
+    controller = JupyterController(os.path.join(SESSIONS_FOLDER, "_pool"))
+    try:
+        await controller.start_kernel()
+
+        # Initialize common imports
+        setup_output = await controller.execute_code(SETUP_CODE)
+        logger.info("Initial setup code executed for pooled kernel. Output: %s", setup_output)
+    except Exception:
+        await controller.cleanup() # Don't leak the kernel if warm-up fails
+        raise
+    return controller
+
+# Background task keeping the kernel pool filled
+async def _pool_filler():
+    """Keeps KERNEL_POOL topped up with warm controllers, blocking while the pool is full."""
+    while True:
+        try:
+            controller = await _make_warm_controller()
+        except Exception as e:
+            logger.error("Error warming pooled kernel: %s", e)
+            await asyncio.sleep(5) # Back off before retrying
+            continue
+        await KERNEL_POOL.put(controller)
+
+# Internal Helper Function
+async def _acquire_warm_controller() -> JupyterController:
+    """Takes a warm controller from the pool, cold-starting one if none becomes available in time."""
+    try:
+        controller = await asyncio.wait_for(KERNEL_POOL.get(), timeout=KERNEL_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.info("Kernel pool empty. Cold-starting a kernel.")
+        return await _make_warm_controller()
+
+    if not await controller.kernel_manager.is_alive():
+        logger.info("Pooled kernel died while idle. Cold-starting a replacement.")
+        await controller.cleanup()
+        return await _make_warm_controller()
+    return controller
 
 # Internal Helper Function
 async def _create_session(conversation_id: str) -> SessionInfo:
-    """Creates a new Jupyter session, kernel, notebook, and runs initial setup code."""
+    """Creates a new Jupyter session from a pre-warmed kernel, falling back to a cold start."""
     if conversation_id in sessions:
         # Clean up existing session if it somehow exists before creation attempt
-        print(f"Warning: Cleaning up existing session for {conversation_id} during creation request.")
-        sessions[conversation_id].controller.cleanup()
+        logger.warning("Cleaning up existing session for %s during creation request.", conversation_id)
+        await sessions[conversation_id].controller.cleanup()
         del sessions[conversation_id]
 
     session_folder = os.path.join(SESSIONS_FOLDER, conversation_id)
-    controller = JupyterController(session_folder)
+    controller = None
 
     try:
-        print(f"Creating new session for: {conversation_id}")
-        notebook_path = await controller.create_notebook(f"notebook_{conversation_id}")
+        logger.info("Creating new session for: %s", conversation_id)
+        controller = await _acquire_warm_controller()
+        controller.rebind(session_folder)
         session_info = SessionInfo(controller, time.time())
         sessions[conversation_id] = session_info
+        _schedule_eviction(conversation_id, session_info)
 
-        # Initialize common imports
-        setup_code = """
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import os
-# Set backend for matplotlib to Agg to avoid GUI issues in non-interactive env
-import matplotlib
-matplotlib.use('Agg')
-print("Initial imports (pandas, numpy, matplotlib, os) loaded.")
-        """
-        # Execute setup code - handle potential errors during setup
-        try:
-            setup_output = await controller.execute_code(setup_code)
-            print(f"Initial setup code executed for {conversation_id}. Output: {setup_output}")
-        except Exception as setup_error:
-             print(f"Error executing initial setup code for {conversation_id}: {setup_error}")
-             # Clean up the session if setup fails
-             controller.cleanup()
-             del sessions[conversation_id]
-             raise HTTPException(status_code=500, detail=f"Failed to initialize session environment: {setup_error}")
-
-
-        print(f"Session created successfully for: {conversation_id}")
+        logger.info("Session created successfully for: %s", conversation_id)
         return session_info
     except Exception as e:
-        print(f"Error during session creation for {conversation_id}: {e}")
-        controller.cleanup() # Ensure cleanup if creation fails at any point
+        logger.error("Error during session creation for %s: %s", conversation_id, e)
+        if controller:
+            await controller.cleanup() # Ensure cleanup if creation fails at any point
         raise HTTPException(status_code=500, detail=f"Failed to create session: {str(e)}")
 
+# Leading distribution name of a requirement string, e.g. 'scikit-learn' in 'scikit-learn[all]>=1.0'
+_REQUIREMENT_NAME_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+@functools.lru_cache(maxsize=None)
+def _import_name(package_name: str) -> str:
+    """Best-effort module name for a pip requirement (handles simple cases like 'package-name', 'package==1.0')."""
+    match = _REQUIREMENT_NAME_RE.match(package_name)
+    name = match.group(1) if match else package_name
+    return name.replace('-', '_')
+
+# Bare or exactly pinned requirement, the only forms the wheel cache can serve, e.g. 'tabulate' or 'tabulate==0.9.0'
+_CACHEABLE_REQUIREMENT_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:==\s*([A-Za-z0-9._+!-]+))?\s*$")
+
+def _normalize_name(name: str) -> str:
+    """Canonical project name as used in wheel filenames, e.g. 'Scikit-Learn' -> 'scikit_learn'."""
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+def _wheel_index() -> Dict[str, Dict[str, str]]:
+    """Maps normalized project name -> {version: wheel path} for WHEEL_CACHE, re-listed whenever the directory changes."""
+    try:
+        mtime = os.stat(WHEEL_CACHE).st_mtime_ns # Changes when wheels are added to or removed from the directory
+    except OSError:
+        return {} # No wheel cache mounted
+    return _list_wheel_cache(WHEEL_CACHE, mtime)
+
+@functools.lru_cache(maxsize=1)
+def _list_wheel_cache(wheel_cache: str, mtime: int) -> Dict[str, Dict[str, str]]:
+    """Lists the pure-Python wheels in a directory; cached per directory mtime by _wheel_index."""
+    index: Dict[str, Dict[str, str]] = {}
+    for filename in os.listdir(wheel_cache):
+        # Wheel filenames are {name}-{version}(-{build})?-{python}-{abi}-{platform}.whl
+        parts = filename[:-len(".whl")].split("-") if filename.endswith(".whl") else []
+        if len(parts) in (5, 6) and parts[-1] == "any":
+            index.setdefault(_normalize_name(parts[0]), {})[parts[1]] = os.path.join(wheel_cache, filename)
+    return index
+
+def _installed_version(name: str) -> Optional[str]:
+    """Version of an installed distribution, or None if it is not installed."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def _unpack_cached_wheel(wheel_path: str) -> bool:
+    """Unpacks a pure-Python wheel into site-packages; returns False if it needs a real installer."""
+    with zipfile.ZipFile(wheel_path) as wheel:
+        names = wheel.namelist()
+        dist_info = next((n.split("/")[0] for n in names if n.endswith(".dist-info/WHEEL")), None)
+        if not dist_info or any(n.split("/")[0].endswith(".data") for n in names):
+            return False # Scripts, headers or data files need pip's install schemes
+        if "Root-Is-Purelib: true" not in wheel.read(f"{dist_info}/WHEEL").decode():
+            return False
+        # Dependencies are not resolved here, so every unconditional one must already be installed
+        for line in wheel.read(f"{dist_info}/METADATA").decode().splitlines():
+            if line.startswith("Requires-Dist:") and "extra ==" not in line:
+                match = _REQUIREMENT_NAME_RE.match(line[len("Requires-Dist:"):])
+                if match and _installed_version(match.group(1)) is None:
+                    return False
+        wheel.extractall(sysconfig.get_paths()["purelib"])
+    return True
+
+def _install_from_wheel_cache(package_names: List[str]) -> List[str]:
+    """Satisfies what it can from WHEEL_CACHE; returns the packages pip still has to install."""
+    remaining = []
+    for package_name in package_names:
+        match = _CACHEABLE_REQUIREMENT_RE.match(package_name)
+        if not match:
+            remaining.append(package_name) # Ranges, extras and URLs need pip's resolver
+            continue
+        name, version = match.groups()
+        versions = _wheel_index().get(_normalize_name(name), {})
+        if not versions:
+            remaining.append(package_name) # Not in the cache, pip decides whether anything needs installing
+            continue
+        installed = _installed_version(name)
+        if installed and (version is None or installed == version):
+            continue # Already satisfied, e.g. unpacked from the cache for an earlier session
+        if installed:
+            remaining.append(package_name) # Another version is installed; an extract can't uninstall it, pip can
+            continue
+        wheel_path = versions.get(version) if version else None
+        if version is None and len(versions) == 1:
+            wheel_path = next(iter(versions.values()))
+        try:
+            unpacked = bool(wheel_path) and _unpack_cached_wheel(wheel_path)
+        except (zipfile.BadZipFile, KeyError, OSError) as e:
+            logger.warning("Unusable cached wheel %s: %s", wheel_path, e)
+            unpacked = False
+        if unpacked:
+            logger.info("Installed %s from wheel cache %s", package_name, wheel_path)
+        else:
+            remaining.append(package_name)
+    return remaining
+
+# Internal Helper Function
+async def _pip_install(package_names: List[str]) -> subprocess.CompletedProcess:
+    """Runs one pip install for all given packages in a worker thread."""
+    # Target the server's interpreter explicitly to ensure correct environment
+    return await asyncio.to_thread(
+        subprocess.run,
+        [*PIP_INSTALL_COMMAND, *package_names],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=300 * len(package_names)  # 5 minute timeout per package
+    )
+
 # Internal Helper Function
 async def _install_dependencies(session_info: SessionInfo, dependencies: List[str]):
-    """Installs a list of dependencies using pip and attempts to import them in the kernel."""
-    if not dependencies:
+    """Installs a list of dependencies with a single pip call and imports them all in one kernel cell.
+
+    Dependencies already installed and imported earlier in the session are skipped, and ones available
+    in WHEEL_CACHE are unpacked without starting pip.
+    """
+    # Skip empty strings in the list and anything this session already has
+    package_names = [p for p in dict.fromkeys(dependencies) if p and p not in session_info.installed]
+    if not package_names:
         return # Nothing to install
 
     controller = session_info.controller
-    print(f"Installing dependencies for session {session_info.controller.folder_path}: {dependencies}")
-
-    for package_name in dependencies:
-        if not package_name: continue # Skip empty strings in the list
+    packages_label = ", ".join(f"'{p}'" for p in package_names)
+    logger.info("Installing dependencies for session %s: %s", session_info.controller.folder_path, package_names)
 
-        try:
-            print(f"Attempting to install {package_name}...")
-            # Use python -m pip to ensure correct environment
-            result = await asyncio.to_thread(
-                subprocess.run,
-                ["python", "-m", "pip", "install", package_name],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=300  # 5 minute timeout per package
-            )
+    try:
+        pip_names = await asyncio.to_thread(_install_from_wheel_cache, package_names)
+        pip_label = ", ".join(f"'{p}'" for p in pip_names)
+        if pip_names:
+            logger.debug("Attempting to install %s...", pip_label)
+            result = await _pip_install(pip_names)
 
             if result.returncode != 0:
-                print(f"Failed pip install for {package_name}. Stderr: {result.stderr}")
+                # Fall back to one install per package only to pinpoint which one failed
+                logger.error("Batched pip install failed for %s. Retrying packages individually. Stderr: %s", pip_label, result.stderr)
+                for package_name in pip_names:
+                    package_result = await _pip_install([package_name])
+                    if package_result.returncode != 0:
+                        logger.error("Failed pip install for %s. Stderr: %s", package_name, package_result.stderr)
+                        raise HTTPException(
+                            status_code=400, # Bad request as dependency failed
+                            detail=f"Failed to install dependency '{package_name}': {package_result.stderr or package_result.stdout}"
+                        )
+                # Every package installs on its own, so the combination itself is unsatisfiable
                 raise HTTPException(
-                    status_code=400, # Bad request as dependency failed
-                    detail=f"Failed to install dependency '{package_name}': {result.stderr or result.stdout}"
+                    status_code=400,
+                    detail=f"Failed to install dependencies {pip_label} together: {result.stderr or result.stdout}"
                 )
             else:
-                 print(f"Successfully installed {package_name}. Output: {result.stdout}")
+                 logger.info("Successfully installed %s. Output: %s", pip_label, result.stdout)
 
 
-            # If installation successful, try importing in the kernel
-            # Basic import name extraction (handles simple cases like 'package-name', 'package==1.0')
-            import_name = package_name.split('[')[0].split('==')[0].split('<')[0].split('>')[0].replace('-', '_')
-            import_code = f"import {import_name}"
-            print(f"Attempting to import {import_name} in kernel...")
-            try:
-                import_output = await controller.execute_code(import_code)
-                print(f"Successfully imported {import_name}. Output: {import_output}")
-            except HTTPException as import_error:
-                 # If import fails after successful install, raise specific error
-                 print(f"Failed to import {import_name} after installation: {import_error.detail}")
-                 raise HTTPException(
-                    status_code=400,
-                    detail=f"Package '{package_name}' installed but failed to import in kernel: {import_error.detail}"
-                 )
+        # If installation successful, import everything in the kernel with a single cell
+        import_names = [_import_name(p) for p in package_names]
+        import_code = "; ".join(f"import {name}" for name in import_names)
+        logger.debug("Attempting to import %s in kernel...", import_names)
+        try:
+            import_output = await controller.execute_code(import_code)
+            logger.info("Successfully imported %s. Output: %s", import_names, import_output)
+            session_info.installed.update(package_names)
+        except HTTPException as import_error:
+             # If import fails after successful install, raise specific error
+             logger.error("Failed to import %s after installation: %s", import_names, import_error.detail)
+             raise HTTPException(
+                status_code=400,
+                detail=f"Packages {packages_label} installed but failed to import in kernel: {import_error.detail}"
+             )
+
+    except subprocess.TimeoutExpired:
+        logger.error("Timeout installing %s", packages_label)
+        raise HTTPException(
+            status_code=408, # Request Timeout
+            detail=f"Package installation timed out for {packages_label}"
+        )
+    except HTTPException:
+         raise # Re-raise HTTPExceptions from install/import failures
+    except Exception as e:
+        logger.error("Unexpected error installing %s: %s", packages_label, e)
+        raise HTTPException(status_code=500, detail=f"Unexpected error installing dependencies {packages_label}: {str(e)}")
 
-        except subprocess.TimeoutExpired:
-            print(f"Timeout installing {package_name}")
-            raise HTTPException(
-                status_code=408, # Request Timeout
-                detail=f"Package installation timed out for '{package_name}'"
-            )
-        except HTTPException:
-             raise # Re-raise HTTPExceptions from install/import failures
-        except Exception as e:
-            print(f"Unexpected error installing {package_name}: {e}")
-            raise HTTPException(status_code=500, detail=f"Unexpected error installing dependency '{package_name}': {str(e)}")
+# Internal Helper Function
+async def _reset_with_setup(session_info: SessionInfo):
+    """Restarts the kernel and re-runs SETUP_CODE, which a restart wipes out along with the rest of the kernel state."""
+    controller = session_info.controller
+    session_info.installed.clear() # The new kernel has none of the earlier imports, so they must run again
+    await controller.reset_kernel()
+    try:
+        setup_output = await controller.execute_code(SETUP_CODE)
+        logger.info("Setup code executed after reset for %s. Output: %s", controller.folder_path, setup_output)
+    except Exception as setup_error:
+        logger.error("Error executing setup code after reset for %s: %s", controller.folder_path, setup_error)
+        raise HTTPException(status_code=500, detail=f"Kernel reset, but failed to re-initialize environment: {setup_error}")
+
+# Internal Helper Function
+@contextlib.asynccontextmanager
+async def _locked_session(conversation_id: str, session_info: SessionInfo):
+    """Holds the session's exec_lock, raising 404 if the session was ended or replaced while waiting for it."""
+    async with session_info.exec_lock:
+        if sessions.get(conversation_id) is not session_info:
+            raise HTTPException(status_code=404, detail=f"Session '{conversation_id}' not found. Please start a new session or check the ID.")
+        yield
 
 # Helper function
 async def get_session(conversation_id: str) -> SessionInfo:
@@ -339,197 +693,252 @@ async def get_session(conversation_id: str) -> SessionInfo:
 
     session_info = sessions[conversation_id]
     session_info.last_activity = time.time() # Update activity time on access
+    _schedule_eviction(conversation_id, session_info) # Push back the inactivity cleanup
 
-    # Check kernel readiness more robustly
-    if not session_info.controller.kernel_manager or not session_info.controller.kernel_manager.is_alive():
-         session_info.controller._kernel_ready = False
-         print(f"Kernel for session {conversation_id} found dead or uninitialized. Attempting reset...")
-         try:
-             # Try resetting if kernel is dead
-             await session_info.controller.reset_kernel()
-             # Re-run setup code after reset
-             setup_code = """
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import os
-import matplotlib
-matplotlib.use('Agg')
-print("Re-running initial imports after kernel reset.")
-             """
-             await session_info.controller.execute_code(setup_code)
-             print(f"Kernel for {conversation_id} reset successfully.")
-         except Exception as reset_error:
-             print(f"Failed to reset dead kernel for {conversation_id}: {reset_error}")
-             # Cleanup the broken session if reset fails
-             session_info.controller.cleanup()
-             del sessions[conversation_id]
-             raise HTTPException(status_code=500, detail=f"Kernel for session '{conversation_id}' died and could not be reset. Please start a new session.")
-
-    elif not session_info.controller._kernel_ready:
-        print(f"Kernel for session {conversation_id} not ready. Waiting...")
-        try:
-            await session_info.controller._wait_for_kernel_ready(timeout=15) # Wait for readiness
-        except TimeoutError:
-            print(f"Kernel for {conversation_id} timed out waiting for ready state. Attempting reset...")
-            # If still not ready after waiting, try resetting
+    # A live kernel that is ready needs no probe; this is the common case and doesn't wait for the lock
+    controller = session_info.controller
+    if controller.kernel_manager and controller._kernel_ready and await controller.kernel_manager.is_alive():
+        return session_info
+
+    # Probes and resets read the shell channel, so like executions they run under exec_lock; otherwise one request
+    # could consume and discard the shell reply another is waiting for
+    async with _locked_session(conversation_id, session_info):
+        # Check kernel readiness again: while waiting, another request may already have recovered it
+        if not controller.kernel_manager or not await controller.kernel_manager.is_alive():
+            controller._kernel_ready = False
+            logger.info("Kernel for session %s found dead or uninitialized. Attempting reset...", conversation_id)
             try:
-                await session_info.controller.reset_kernel()
-                # Re-run setup code after reset
-                setup_code = """
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import os
-import matplotlib
-matplotlib.use('Agg')
-print("Re-running initial imports after kernel reset.")
-                """
-                await session_info.controller.execute_code(setup_code)
-                print(f"Kernel for {conversation_id} reset successfully after timeout.")
+                # Try resetting if kernel is dead
+                await _reset_with_setup(session_info)
+                logger.info("Kernel for %s reset successfully.", conversation_id)
             except Exception as reset_error:
-                 print(f"Failed to reset kernel for {conversation_id} after timeout: {reset_error}")
-                 # Cleanup the broken session if reset fails
-                 session_info.controller.cleanup()
-                 del sessions[conversation_id]
-                 raise HTTPException(status_code=500, detail=f"Kernel for session '{conversation_id}' failed to become ready and could not be reset. Please start a new session.")
+                logger.error("Failed to reset dead kernel for %s: %s", conversation_id, reset_error)
+                # Cleanup the broken session if reset fails
+                await controller.cleanup()
+                sessions.pop(conversation_id, None) # /end_session doesn't take the lock and may have removed it already
+                raise HTTPException(status_code=500, detail=f"Kernel for session '{conversation_id}' died and could not be reset. Please start a new session.")
+
+        elif not controller._kernel_ready:
+            logger.info("Kernel for session %s not ready. Waiting...", conversation_id)
+            try:
+                await controller._wait_for_kernel_ready(timeout=15) # Wait for readiness
+            except TimeoutError:
+                logger.info("Kernel for %s timed out waiting for ready state. Attempting reset...", conversation_id)
+                # If still not ready after waiting, try resetting
+                try:
+                    await _reset_with_setup(session_info)
+                    logger.info("Kernel for %s reset successfully after timeout.", conversation_id)
+                except Exception as reset_error:
+                    logger.error("Failed to reset kernel for %s after timeout: %s", conversation_id, reset_error)
+                    # Cleanup the broken session if reset fails
+                    await controller.cleanup()
+                    sessions.pop(conversation_id, None) # /end_session doesn't take the lock and may have removed it already
+                    raise HTTPException(status_code=500, detail=f"Kernel for session '{conversation_id}' failed to become ready and could not be reset. Please start a new session.")
 
     return session_info
 
 
-# Background task for cleaning up inactive sessions
-async def cleanup_inactive_sessions():
-    """Periodically checks for and cleans up sessions inactive for more than an hour."""
-    while True:
-        await asyncio.sleep(300)  # Check every 5 minutes
-        current_time = time.time()
-        to_remove = []
-        # Copy keys first for safe iteration and removal
-        session_ids = list(sessions.keys())
-
-        for conversation_id in session_ids:
-             # Check if session still exists (might have been removed by end_session)
-             if conversation_id in sessions:
-                session_info = sessions[conversation_id]
-                # Check inactivity duration (1 hour)
-                if current_time - session_info.last_activity > 3600:
-                    print(f"Session {conversation_id} inactive for too long. Scheduling cleanup.")
-                    to_remove.append(conversation_id)
-
-        for conversation_id in to_remove:
-            if conversation_id in sessions: # Double check before popping
-                print(f"Executing cleanup for inactive session: {conversation_id}")
-                session_info = sessions.pop(conversation_id)
-                # Run cleanup in a separate task to avoid blocking the loop
-                asyncio.create_task(asyncio.to_thread(session_info.controller.cleanup))
-            else:
-                 print(f"Session {conversation_id} already removed before scheduled cleanup.")
+# Internal Helper Function
+async def _get_or_create_session(conversation_id: str) -> SessionInfo:
+    """Returns the session for a conversation, creating it on first use; /run and /run_batch start sessions implicitly."""
+    # Check if session exists, get it if it does
+    if conversation_id in sessions:
+        logger.debug("Getting existing session: %s", conversation_id)
+        return await get_session(conversation_id) # Updates activity, checks kernel
+    # Create new session if it doesn't exist
+    logger.info("No existing session found for %s. Creating new one.", conversation_id)
+    return await _create_session(conversation_id)
+
+
+# Inactivity-based session eviction
+def _schedule_eviction(conversation_id: str, session_info: SessionInfo, delay: Optional[float] = None):
+    """(Re)arms the inactivity timer for a session, replacing any pending one."""
+    if session_info._eviction_handle:
+        session_info._eviction_handle.cancel()
+    session_info._eviction_handle = asyncio.get_running_loop().call_later(
+        SESSION_INACTIVITY_TIMEOUT if delay is None else delay, _maybe_evict_session, conversation_id, session_info
+    )
+
+def _maybe_evict_session(conversation_id: str, session_info: SessionInfo):
+    """Timer callback that cleans up a session once it has been inactive for too long."""
+    if sessions.get(conversation_id) is not session_info:
+        return # Session already ended or replaced
+
+    inactive_for = time.time() - session_info.last_activity
+    if inactive_for < SESSION_INACTIVITY_TIMEOUT:
+        # Activity happened without re-arming the timer; check again when it would expire
+        _schedule_eviction(conversation_id, session_info, SESSION_INACTIVITY_TIMEOUT - inactive_for)
+        return
+
+    logger.info("Session %s inactive for too long. Executing cleanup.", conversation_id)
+    sessions.pop(conversation_id)
+    # Run cleanup in a separate task to avoid blocking the loop
+    asyncio.create_task(_cleanup_removed_session(session_info))
+
+# Internal Helper Function
+async def _cleanup_removed_session(session_info: SessionInfo):
+    """Cleans up the kernel of a session already removed from `sessions`, without closing it under in-flight work."""
+    try:
+        # A reset or execution still holding the lock would otherwise have its sockets closed underneath it
+        await asyncio.wait_for(session_info.exec_lock.acquire(), timeout=SESSION_CLEANUP_GRACE)
+    except asyncio.TimeoutError:
+        logger.warning("Session for %s still busy after %s s. Cleaning up anyway.", session_info.controller.folder_path, SESSION_CLEANUP_GRACE)
+        await session_info.controller.cleanup()
+        return
+    try:
+        await session_info.controller.cleanup()
+    finally:
+        session_info.exec_lock.release()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Ensure sessions folder exists and start the background cleanup task."""
+    """Configure logging, ensure sessions folder exists and start the iopub dispatcher and kernel pool tasks."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     os.makedirs(SESSIONS_FOLDER, exist_ok=True)
-    asyncio.create_task(cleanup_inactive_sessions())
+    asyncio.create_task(IOPUB_DISPATCHER.run())
+    asyncio.create_task(_pool_filler())
+
+# Internal Helper Function
+async def _stream_execution(session_info: SessionInfo, request: RunRequest) -> AsyncIterator[str]:
+    """Installs dependencies and yields one NDJSON line per output chunk, ending with an error line on failure."""
+    conversation_id = request.conversation_id
+    try:
+        # Taken inside the generator so the lock is only held while the body is actually being sent
+        async with _locked_session(conversation_id, session_info):
+            if request.dependencies:
+                await _install_dependencies(session_info, request.dependencies)
+            async for chunk in session_info.controller.execute_code_stream(request.code, timeout=request.timeout):
+                yield json.dumps({"output": chunk}) + "\n"
+        logger.debug("Streamed code execution finished for %s", conversation_id)
+    except HTTPException as e:
+        # The status line has already been sent, so report failures in-band
+        logger.warning("HTTPException in streamed /run for %s: Status=%s, Detail=%s", conversation_id, e.status_code, e.detail)
+        yield json.dumps({"error": e.detail, "status_code": e.status_code}) + "\n"
+    except Exception as e:
+        logger.exception("Unexpected error in streamed /run for %s: %s - %s", conversation_id, type(e).__name__, e)
+        yield json.dumps({"error": f"An unexpected internal server error occurred: {str(e)}", "status_code": 500}) + "\n"
+
+# Cheap liveness endpoint; lets clients open and warm a connection without touching any kernel
+@app.get("/health")
+async def health():
+    """Reports that the server is up, with the number of active sessions and warm kernels."""
+    return {"status": "ok", "sessions": len(sessions), "warm_kernels": KERNEL_POOL.qsize()}
 
 # Main endpoint for running code
-@app.post("/run")
-async def run_code_in_session(request: RunRequest):
+@app.post("/run", response_model=RunResponse)
+async def run_code_in_session(request: RunRequest, stream: bool = False):
     """
     Handles session creation/retrieval, dependency installation, and code execution.
+    With `?stream=true` the output is sent as NDJSON lines while the code runs.
     """
     conversation_id = request.conversation_id
-    session_info: SessionInfo
 
     try:
-        # Check if session exists, get it if it does
-        if conversation_id in sessions:
-            print(f"Getting existing session: {conversation_id}")
-            session_info = await get_session(conversation_id) # Updates activity, checks kernel
-        else:
-            # Create new session if it doesn't exist
-            print(f"No existing session found for {conversation_id}. Creating new one.")
-            session_info = await _create_session(conversation_id)
-
-        # Install dependencies if any are provided in the request
-        if request.dependencies:
-            await _install_dependencies(session_info, request.dependencies)
-
-        # Execute the provided code in the session's kernel
-        print(f"Executing code for session: {conversation_id}")
-        output = await session_info.controller.execute_code(request.code)
-        print(f"Code execution finished for {conversation_id}. Output length: {len(output)}")
+        session_info = await _get_or_create_session(conversation_id)
+
+        if stream:
+            return StreamingResponse(_stream_execution(session_info, request), media_type="application/x-ndjson")
+
+        # Concurrent requests for the same session would interleave on the kernel, so run them one at a time
+        async with _locked_session(conversation_id, session_info):
+            # Install dependencies if any are provided in the request
+            if request.dependencies:
+                await _install_dependencies(session_info, request.dependencies)
+
+            # Execute the provided code in the session's kernel
+            logger.debug("Executing code for session: %s", conversation_id)
+            output = await session_info.controller.execute_code(request.code, timeout=request.timeout)
+        logger.debug("Code execution finished for %s. Output length: %s", conversation_id, len(output))
         return {"output": output}
 
     except HTTPException as e:
          # Re-raise HTTPExceptions directly (e.g., from get_session, install, execute)
-         print(f"HTTPException in /run for {conversation_id}: Status={e.status_code}, Detail={e.detail}")
+         logger.warning("HTTPException in /run for %s: Status=%s, Detail=%s", conversation_id, e.status_code, e.detail)
          raise e
     except Exception as e:
         # Catch any other unexpected errors during the process
-        print(f"Unexpected error in /run for {conversation_id}: {type(e).__name__} - {e}")
-        import traceback
-        traceback.print_exc() # Log full traceback for unexpected errors
+        # Log full traceback for unexpected errors
+        logger.exception("Unexpected error in /run for %s: %s - %s", conversation_id, type(e).__name__, e)
         raise HTTPException(status_code=500, detail=f"An unexpected internal server error occurred: {str(e)}")
 
 
+# Endpoint for running several independent snippets in one round-trip
+@app.post("/run_batch", response_model=RunBatchResponse)
+async def run_batch_in_session(request: RunBatchRequest):
+    """
+    Runs items in order in one session and reports a result per item; a failing item does not stop the batch.
+    """
+    conversation_id = request.conversation_id
+    try:
+        session_info = await _get_or_create_session(conversation_id)
+    except HTTPException as e:
+        logger.warning("HTTPException in /run_batch for %s: Status=%s, Detail=%s", conversation_id, e.status_code, e.detail)
+        raise e
+
+    results = []
+    # Hold the lock for the whole batch so no other request interleaves between items
+    async with _locked_session(conversation_id, session_info):
+        for item in request.items:
+            try:
+                if item.dependencies:
+                    await _install_dependencies(session_info, item.dependencies)
+                output = await session_info.controller.execute_code(item.code, timeout=request.timeout)
+                results.append({"status_code": 200, "output": output})
+            except HTTPException as e:
+                results.append({"status_code": e.status_code, "detail": e.detail})
+            except Exception as e:
+                logger.exception("Unexpected error in /run_batch for %s: %s - %s", conversation_id, type(e).__name__, e)
+                results.append({"status_code": 500, "detail": f"An unexpected internal server error occurred: {str(e)}"})
+    logger.debug("Batch of %s items finished for %s", len(results), conversation_id)
+    return {"results": results}
+
+
 # Endpoint to reset a session's kernel
 @app.post("/reset")
-async def reset_session(conversation_id: str = Form(...)):
+async def reset_session(request: SessionRequest):
     """Resets the kernel for an existing session and re-runs initial setup code."""
+    conversation_id = request.conversation_id
     try:
-        print(f"Received reset request for session: {conversation_id}")
+        logger.info("Received reset request for session: %s", conversation_id)
         session_info = await get_session(conversation_id) # Get session, update activity, check kernel
 
-        await session_info.controller.reset_kernel()
-
-        # Reinitialize common imports after reset
-        setup_code = """
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import os
-import matplotlib
-matplotlib.use('Agg')
-print("Re-running initial imports after manual reset.")
-        """
-        try:
-            reset_output = await session_info.controller.execute_code(setup_code)
-            print(f"Setup code executed after reset for {conversation_id}. Output: {reset_output}")
-        except Exception as setup_error:
-             print(f"Error executing setup code after reset for {conversation_id}: {setup_error}")
-             # Session might be unstable, but don't kill it automatically here
-             raise HTTPException(status_code=500, detail=f"Kernel reset, but failed to re-initialize environment: {setup_error}")
-
+        # Wait for any in-flight execution instead of restarting the kernel underneath it
+        async with _locked_session(conversation_id, session_info):
+            # Session might be unstable if setup fails, but don't kill it automatically here
+            await _reset_with_setup(session_info)
 
         return {"message": f"Kernel for session '{conversation_id}' reset successful"}
     except HTTPException as e:
-         print(f"HTTPException in /reset for {conversation_id}: Status={e.status_code}, Detail={e.detail}")
+         logger.warning("HTTPException in /reset for %s: Status=%s, Detail=%s", conversation_id, e.status_code, e.detail)
          raise e
     except Exception as e:
-        print(f"Unexpected error in /reset for {conversation_id}: {e}")
+        logger.error("Unexpected error in /reset for %s: %s", conversation_id, e)
         raise HTTPException(status_code=500, detail=f"Failed to reset session '{conversation_id}': {str(e)}")
 
 # Endpoint to end a session
 @app.post("/end_session")
-async def end_session(conversation_id: str = Form(...)):
+async def end_session(request: SessionRequest):
     """Ends a specific session and schedules cleanup of its resources."""
-    print(f"Received end session request for: {conversation_id}")
+    conversation_id = request.conversation_id
+    logger.info("Received end session request for: %s", conversation_id)
     if conversation_id not in sessions:
         # Return 404 Not Found if the session doesn't exist
         raise HTTPException(status_code=404, detail=f"Session '{conversation_id}' not found.")
 
     # Pop the session info first to prevent race conditions with cleanup task
     session_info = sessions.pop(conversation_id)
-    print(f"Removed session {conversation_id} from active list.")
+    if session_info._eviction_handle:
+        session_info._eviction_handle.cancel() # No inactivity cleanup needed anymore
+    logger.info("Removed session %s from active list.", conversation_id)
 
-    # Perform cleanup asynchronously in the background using asyncio.to_thread
+    # Perform cleanup asynchronously in the background
     try:
-        asyncio.create_task(asyncio.to_thread(session_info.controller.cleanup))
-        print(f"Cleanup task scheduled for session {conversation_id}")
+        asyncio.create_task(_cleanup_removed_session(session_info))
+        logger.info("Cleanup task scheduled for session %s", conversation_id)
         return {"message": f"Session '{conversation_id}' ended successfully and cleanup initiated."}
     except Exception as e:
          # This part might be hard to reach if cleanup runs in background
-         print(f"Error initiating cleanup for {conversation_id}: {e}")
+         logger.error("Error initiating cleanup for %s: %s", conversation_id, e)
          # Even if cleanup initiation fails, the session is removed from the dict
          raise HTTPException(status_code=500, detail=f"Session removed, but error initiating cleanup: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,10 @@
+"""Common imports loaded into every sandbox kernel via `from sandbox_setup import *`."""
+import os
+# Set backend for matplotlib to Agg to avoid GUI issues in non-interactive env
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+print("Initial imports (pandas, numpy, matplotlib, os) loaded.")
@@ -1,214 +1,362 @@
-import requests
+import asyncio
+import gzip
+import hashlib
+import httpx
 import json
+import logging
+import os
+import sys
 import time
 
+# Test output goes through this logger; each API call emits its lines as a single record
+logger = logging.getLogger("apitest")
+
+# JSON helpers built once: orjson's parser when installed (its JSONDecodeError subclasses json's), and one
+# shared indenting encoder for the pretty-printed bodies
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+_PRETTY = json.JSONEncoder(indent=2).encode
+
+BASE_URL = "http://localhost:5002" # Adjust host/port if needed
+
+# Endpoint paths, joined onto BASE_URL by the client
+RUN_URL = "/run"
+RUN_BATCH_URL = "/run_batch"
+RESET_URL = "/reset"
+END_URL = "/end_session"
+HEALTH_URL = "/health"
+
+# Request bodies above this many bytes are sent gzip-compressed (large code snippets); httpx already sends
+# Accept-Encoding: gzip and transparently decodes compressed responses
+GZIP_MIN_SIZE = 1024
+
+# Successful response bodies are only logged with APITEST_VERBOSE=1; failures always are
+VERBOSE = os.getenv("APITEST_VERBOSE") == "1"
+
+# Opt-in record/replay: with APITEST_REPLAY=1 responses are stored under REPLAY_DIR and replayed on later runs
+REPLAY = os.getenv("APITEST_REPLAY") == "1"
+REPLAY_DIR = ".apitest_cache"
+EXPIRATION_SECS = float(os.getenv("APITEST_REPLAY_EXPIRATION", 24 * 3600)) # Recordings older than this are refreshed
+CONVERSATION_ID_PLACEHOLDER = "<conversation_id>" # Stands in for the per-run ID in keys and stored bodies
+_replay_occurrences = {} # Identical requests (e.g. /reset before and after /end_session) are keyed by occurrence
+
+def _replay_key(url, fields):
+    """Key for a request: endpoint, body without the per-run conversation ID, and how often it was sent before."""
+    normalized = dict(fields, conversation_id=CONVERSATION_ID_PLACEHOLDER)
+    request_id = json.dumps([url, normalized], sort_keys=True)
+    occurrence = _replay_occurrences.get(request_id, 0)
+    _replay_occurrences[request_id] = occurrence + 1
+    return hashlib.sha256(f"{request_id}#{occurrence}".encode()).hexdigest()
+
+async def _send(client, url, json_payload, timeout):
+    """POSTs a JSON body, gzip-compressed when it is larger than GZIP_MIN_SIZE."""
+    body = json.dumps(json_payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if len(body) > GZIP_MIN_SIZE:
+        body = gzip.compress(body, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    return await client.post(url, content=body, headers=headers, timeout=timeout)
+
+async def _post(client, url, *, timeout, json_payload):
+    """POSTs via the shared client, or via the replay cache when APITEST_REPLAY=1."""
+    if not REPLAY:
+        return await _send(client, url, json_payload, timeout)
+
+    conversation_id = json_payload["conversation_id"]
+    path = os.path.join(REPLAY_DIR, f"{_replay_key(url, json_payload)}.json")
+    try:
+        if time.time() - os.path.getmtime(path) < EXPIRATION_SECS:
+            with open(path) as f:
+                recorded = loads(f.read())
+            body = recorded["body"].replace(CONVERSATION_ID_PLACEHOLDER, conversation_id)
+            return httpx.Response(recorded["status_code"], text=body, request=httpx.Request("POST", client.base_url.join(url)))
+    except FileNotFoundError:
+        pass # Not recorded yet
+
+    response = await _send(client, url, json_payload, timeout)
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"status_code": response.status_code, "body": response.text.replace(conversation_id, CONVERSATION_ID_PLACEHOLDER)}, f)
+    return response
+
+# Pool sizing: keep-alive connections are reused across calls, and the pool is sized above the suite's
+# peak concurrency so concurrent steps never queue behind it
+CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=16, max_connections=32)
+
+# Timeouts: connecting to a local server takes well under a millisecond, so a short connect timeout fails fast
+# when it is down; read timeouts are per endpoint and bound the work each one does
+CONNECT_TIMEOUT = 1.0
+TIMEOUTS = {
+    RUN_URL: httpx.Timeout(90.0, connect=CONNECT_TIMEOUT), # Execution deadline is 60 s plus dependency installs
+    RUN_BATCH_URL: httpx.Timeout(90.0, connect=CONNECT_TIMEOUT), # Per item; scaled by the batch size
+    RESET_URL: httpx.Timeout(120.0, connect=CONNECT_TIMEOUT), # Worst case ~105 s: 15 s readiness wait, 30 s restart, 60 s setup code
+    END_URL: httpx.Timeout(15.0, connect=CONNECT_TIMEOUT), # Returns once cleanup is scheduled
+    HEALTH_URL: httpx.Timeout(5.0, connect=CONNECT_TIMEOUT), # Answered without touching a kernel
+}
+
 # --- API Interaction Functions (with enhanced logging) ---
 
-def run_code(conversation_id, code, dependencies=None, expected_status=200):
+async def _call(client, endpoint, details, *, json_payload, expected_status, check_only=False):
     """
-    Calls the /run endpoint, prints details, and checks the status code.
-    Returns the response JSON if successful, None otherwise.
+    POSTs to an endpoint, logs the call and its outcome as one record, and checks the status code.
+    Returns (True, body) when the status matches, where body is the decoded JSON (the text if not JSON,
+    None with check_only), and (False, None) otherwise. VERBOSE only decides whether the body is logged.
     """
-    url = "http://localhost:5002/run" # Adjust host/port if needed
-    payload = {"conversation_id": conversation_id, "code": code}
-    if dependencies:
-        payload["dependencies"] = dependencies
-
-    print(f"\n>>> Calling /run")
-    print(f"    Conversation ID: {conversation_id}")
-    print(f"    Dependencies:    {dependencies or 'None'}")
-    print(f"    Code Snippet:    {code.strip()[:80]}{'...' if len(code.strip()) > 80 else ''}")
-    print(f"    Expected Status: {expected_status}")
-
+    lines = [f"\n>>> Calling {endpoint}", *details, f"    Expected Status: {expected_status}"] # Emitted as one log record so concurrent calls don't interleave
+    append, pretty, decode = lines.append, _PRETTY, loads # Bound once, every branch below uses them
     try:
-        response = requests.post(url, json=payload, timeout=90) # Increased timeout slightly
+        response = await _post(client, endpoint, json_payload=json_payload, timeout=TIMEOUTS[endpoint])
+        status_code, content = response.status_code, response.content
 
-        print(f"<<< Response from /run")
-        print(f"    Status Code: {response.status_code}")
+        append(f"<<< Response from {endpoint}")
+        append(f"    Status Code: {status_code}")
 
-        if response.status_code == expected_status:
-            print(f"    Result: SUCCESS (Status code matches expected)")
+        if status_code == expected_status:
+            append(f"    Result: SUCCESS (Status code matches expected)")
+            if check_only and not VERBOSE:
+                return True, None # Skip decoding a body nobody reads or prints
             try:
-                result_json = response.json()
-                print(f"    Response Body:\n{json.dumps(result_json, indent=2)}")
-                return result_json
+                result = decode(content)
+                if VERBOSE:
+                    append(f"    Response Body:\n{pretty(result)}")
             except json.JSONDecodeError:
-                print(f"    Response Body (non-JSON): {response.text}")
-                return {"output": response.text} # Return text if not JSON
+                result = response.text
+                if VERBOSE:
+                    append(f"    Response Body (non-JSON): {result}")
+            return True, None if check_only else result
         else:
-            print(f"    Result: FAILURE (Expected status {expected_status}, got {response.status_code})")
+            append(f"    Result: FAILURE (Expected status {expected_status}, got {status_code})")
             try:
-                print(f"    Error Body:\n{json.dumps(response.json(), indent=2)}")
+                append(f"    Error Body:\n{pretty(decode(content))}")
             except json.JSONDecodeError:
-                print(f"    Error Body (non-JSON): {response.text}")
-            return None # Indicate failure
-
-    except requests.Timeout:
-        print(f"<<< Error: Request to /run timed out")
-        print(f"    Result: FAILURE (Timeout)")
-        return None
-    except requests.RequestException as e:
-        print(f"<<< Error calling /run: {e}")
-        print(f"    Result: FAILURE (Request Exception)")
-        return None
-
-def reset_session(conversation_id, expected_status=200):
+                append(f"    Error Body (non-JSON): {response.text}")
+            return False, None # Indicate failure
+
+    except httpx.TimeoutException:
+        append(f"<<< Error: Request to {endpoint} timed out")
+        append(f"    Result: FAILURE (Timeout)")
+        return False, None
+    except httpx.HTTPError as e:
+        append(f"<<< Error calling {endpoint}: {e}")
+        append(f"    Result: FAILURE (Request Exception)")
+        return False, None
+    finally:
+        logger.info("\n".join(lines))
+
+def _snippet_line(label, code):
+    """Log line with the first 80 characters of a code snippet."""
+    snippet = code.strip()
+    return f"{label}{snippet[:80]}{'...' if len(snippet) > 80 else ''}"
+
+async def run_code(client, conversation_id, code, dependencies=None, expected_status=200, check_only=False):
     """
-    Calls the /reset endpoint, prints details, and checks the status code.
-    Returns True on success (matching status code), False otherwise.
+    Calls the /run endpoint, prints details, and checks the status code.
+    Returns the response JSON if successful, None otherwise.
+    With check_only the body is not returned and a successful call returns True.
     """
-    url = "http://localhost:5002/reset" # Adjust host/port if needed
-    data = {"conversation_id": conversation_id}
-
-    print(f"\n>>> Calling /reset")
-    print(f"    Conversation ID: {conversation_id}")
-    print(f"    Expected Status: {expected_status}")
+    payload = {"conversation_id": conversation_id, "code": code}
+    if dependencies:
+        payload["dependencies"] = dependencies
+    details = [
+        f"    Conversation ID: {conversation_id}",
+        f"    Dependencies:    {dependencies or 'None'}",
+        _snippet_line("    Code Snippet:    ", code),
+    ]
+    ok, body = await _call(client, RUN_URL, details, json_payload=payload, expected_status=expected_status, check_only=check_only)
+    if check_only:
+        return ok or None
+    if isinstance(body, str):
+        return {"output": body} # Return text if not JSON
+    return body
+
+async def run_code_batch(client, conversation_id, items):
+    """
+    Calls the /run_batch endpoint with several independent snippets, then prints and checks each item's
+    result like run_code does. `items` are dicts with `code` and optional `dependencies`/`expected_status`.
+    Returns a list with the result JSON of each matching item and None for the others.
+    """
+    lines = [] # Emitted as one log record so concurrent calls don't interleave
+    url = RUN_BATCH_URL
+    payload = {
+        "conversation_id": conversation_id,
+        # Dependencies are only sent when given, the server defaults them to none
+        "items": [{"code": item["code"], "dependencies": item["dependencies"]} if item.get("dependencies") else {"code": item["code"]} for item in items],
+    }
+
+    lines.append(f"\n>>> Calling /run_batch ({len(items)} items)")
+    lines.append(f"    Conversation ID: {conversation_id}")
+    for item in items:
+        code = item["code"]
+        lines.append(f"    - Dependencies:    {item.get('dependencies') or 'None'}")
+        lines.append(_snippet_line("      Code Snippet:    ", code))
+        lines.append(f"      Expected Status: {item.get('expected_status', 200)}")
 
     try:
-        response = requests.post(url, data=data, timeout=45) # Added timeout
+        read_timeout = TIMEOUTS[url].read * len(items)
+        response = await _post(client, url, json_payload=payload, timeout=httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT))
 
-        print(f"<<< Response from /reset")
-        print(f"    Status Code: {response.status_code}")
-
-        if response.status_code == expected_status:
-            print(f"    Result: SUCCESS (Status code matches expected)")
-            try:
-                print(f"    Response Body:\n{json.dumps(response.json(), indent=2)}")
-            except json.JSONDecodeError:
-                 print(f"    Response Body (non-JSON): {response.text}")
-            return True
-        else:
-            print(f"    Result: FAILURE (Expected status {expected_status}, got {response.status_code})")
+        lines.append(f"<<< Response from /run_batch")
+        lines.append(f"    Status Code: {response.status_code}")
+        if response.status_code != 200:
+            lines.append(f"    Result: FAILURE (Batch request failed for all {len(items)} items)")
             try:
-                print(f"    Error Body:\n{json.dumps(response.json(), indent=2)}")
+                lines.append(f"    Error Body:\n{_PRETTY(loads(response.content))}")
             except json.JSONDecodeError:
-                print(f"    Error Body (non-JSON): {response.text}")
-            return False # Indicate failure
-
-    except requests.Timeout:
-        print(f"<<< Error: Request to /reset timed out")
-        print(f"    Result: FAILURE (Timeout)")
-        return False
-    except requests.RequestException as e:
-        print(f"<<< Error calling /reset: {e}")
-        print(f"    Result: FAILURE (Request Exception)")
-        return False
-
-def end_session(conversation_id, expected_status=200):
+                lines.append(f"    Error Body (non-JSON): {response.text}")
+            return [None] * len(items)
+
+        outcomes = []
+        append, pretty = lines.append, _PRETTY # Bound once for the per-item loop
+        for index, (item, result) in enumerate(zip(items, loads(response.content)["results"]), start=1):
+            expected_status = item.get("expected_status", 200)
+            body = {"output": result["output"]} if result["status_code"] == 200 else {"detail": result["detail"]}
+            append(f"    Item {index} Status Code: {result['status_code']}")
+            if result["status_code"] == expected_status:
+                append(f"    Result: SUCCESS (Status code matches expected)")
+                if VERBOSE:
+                    append(f"    {'Response' if expected_status == 200 else 'Error'} Body:\n{pretty(body)}")
+                outcomes.append(body)
+            else:
+                append(f"    Result: FAILURE (Expected status {expected_status}, got {result['status_code']})")
+                append(f"    Error Body:\n{pretty(body)}")
+                outcomes.append(None)
+        return outcomes
+
+    except httpx.TimeoutException:
+        lines.append(f"<<< Error: Request to /run_batch timed out")
+        lines.append(f"    Result: FAILURE (Timeout)")
+        return [None] * len(items)
+    except httpx.HTTPError as e:
+        lines.append(f"<<< Error calling /run_batch: {e}")
+        lines.append(f"    Result: FAILURE (Request Exception)")
+        return [None] * len(items)
+    finally:
+        logger.info("\n".join(lines))
+
+async def reset_session(client, conversation_id, expected_status=200):
     """
-    Calls the /end_session endpoint, prints details, and checks the status code.
+    Calls the /reset endpoint, prints details, and checks the status code.
     Returns True on success (matching status code), False otherwise.
     """
-    url = "http://localhost:5002/end_session" # Adjust host/port if needed
-    data = {"conversation_id": conversation_id}
+    ok, _ = await _call(client, RESET_URL, [f"    Conversation ID: {conversation_id}"],
+                        json_payload={"conversation_id": conversation_id}, expected_status=expected_status,
+                        check_only=True) # Only the status code is returned
+    return ok
 
-    print(f"\n>>> Calling /end_session")
-    print(f"    Conversation ID: {conversation_id}")
-    print(f"    Expected Status: {expected_status}")
-
-    try:
-        response = requests.post(url, data=data, timeout=30)
-
-        print(f"<<< Response from /end_session")
-        print(f"    Status Code: {response.status_code}")
-
-        if response.status_code == expected_status:
-            print(f"    Result: SUCCESS (Status code matches expected)")
-            try:
-                print(f"    Response Body:\n{json.dumps(response.json(), indent=2)}")
-            except json.JSONDecodeError:
-                 print(f"    Response Body (non-JSON): {response.text}")
-            return True
-        else:
-            print(f"    Result: FAILURE (Expected status {expected_status}, got {response.status_code})")
-            try:
-                print(f"    Error Body:\n{json.dumps(response.json(), indent=2)}")
-            except json.JSONDecodeError:
-                print(f"    Error Body (non-JSON): {response.text}")
-            return False # Indicate failure
-
-    except requests.Timeout:
-        print(f"<<< Error: Request to /end_session timed out")
-        print(f"    Result: FAILURE (Timeout)")
-        return False
-    except requests.RequestException as e:
-        print(f"<<< Error calling /end_session: {e}")
-        print(f"    Result: FAILURE (Request Exception)")
-        return False
+async def end_session(client, conversation_id, expected_status=200):
+    """
+    Calls the /end_session endpoint, prints details, and checks the status code.
+    Returns True on success (matching status code), False otherwise.
+    """
+    ok, _ = await _call(client, END_URL, [f"    Conversation ID: {conversation_id}"],
+                        json_payload={"conversation_id": conversation_id}, expected_status=expected_status,
+                        check_only=True) # Only the status code is returned
+    return ok
 
 # --- Test Sequence ---
-print("=============================================")
-print("=== Starting Basic API Test Suite ===")
-print("=============================================")
-
-# Generate a unique ID for this test run
-conversation_id = f"basic_test_{int(time.time())}"
-print(f"Using Conversation ID: {conversation_id}")
-
-# --- Test 1: Implicit Session Start & Basic Print ---
-print("\n--- Test Step 1: Implicit Start & Print ---")
-print("Purpose: Verify first /run call creates a session and executes simple print.")
-run_code(conversation_id, 'message = "Hello World!"; print(message)')
-
-# --- Test 2: Variable Persistence ---
-print("\n--- Test Step 2: Variable Persistence ---")
-print("Purpose: Verify variables set in one /run call persist to the next.")
-run_code(conversation_id, 'a = 10; b = 20')
-run_code(conversation_id, 'c = a + b; print(f"Result of a+b: {c}")') # Expect output: "Result of a+b: 30"
-
-# --- Test 3: Dependency Installation Mechanism ---
-print("\n--- Test Step 3: Dependency Installation (using 'pip') ---")
-print("Purpose: Verify the API handles the 'dependencies' list (installing pip itself).")
-# Installing 'pip' is usually safe and quick, testing the mechanism.
-run_code(conversation_id, 'print("Dependency installation step completed.")', dependencies=["pip"])
-
-# --- Test 4: Code Execution Error Handling ---
-print("\n--- Test Step 4: Execution Error Handling ---")
-print("Purpose: Verify kernel errors (like NameError) are caught and returned (expecting 400).")
-run_code(conversation_id, 'print(non_existent_variable)', expected_status=400)
-
-# --- Test 5: Reset Session ---
-print("\n--- Test Step 5: Reset Session ---")
-print("Purpose: Verify the /reset endpoint successfully resets the kernel.")
-reset_session(conversation_id)
-
-# --- Test 6: Verify State After Reset ---
-print("\n--- Test Step 6: Verify State After Reset ---")
-print("Purpose: Check that variables are cleared after reset (expecting 400 for NameError).")
-run_code(conversation_id, 'print(f"Value of a after reset: {a}")', expected_status=400)
-print("Purpose: Check that the kernel is still usable after reset.")
-run_code(conversation_id, 'print("Kernel is responsive after reset.")')
-
-# --- Test 7: End Session ---
-print("\n--- Test Step 7: End Session ---")
-print("Purpose: Verify the /end_session endpoint successfully terminates the session.")
-end_session(conversation_id)
-
-# --- Test 8: Verify State After End ---
-print("\n--- Test Step 8: Verify State After End ---")
-print("Purpose: Check that /run fails with 404 for the ended session ID.")
-run_code(conversation_id, 'print("This should not execute.")', expected_status=404)
-print("Purpose: Check that /reset fails with 404 for the ended session ID.")
-reset_session(conversation_id, expected_status=404)
-
-print("\n=============================================")
-print(f"=== Test Suite Finished for ID: {conversation_id} ===")
-print("=============================================")
+async def warm_up(client):
+    """Opens the pooled connection with a cheap /health call so Step 1 doesn't pay for connection setup."""
+    try:
+        await client.get(HEALTH_URL, timeout=TIMEOUTS[HEALTH_URL])
+    except httpx.HTTPError:
+        pass # The real calls report an unreachable server
+
+async def _step_variable_persistence(client, conversation_id):
+    """Step 2: the two calls must run in order, the second reads variables set by the first."""
+    await run_code(client, conversation_id, 'a = 10; b = 20', check_only=True)
+    await run_code(client, conversation_id, 'c = a + b; print(f"Result of a+b: {c}")', check_only=True) # Expect output: "Result of a+b: 30"
+
+async def main():
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=CLIENT_LIMITS, timeout=TIMEOUTS[RUN_URL]) as client:
+        await warm_up(client)
+
+        logger.info("=============================================")
+        logger.info("=== Starting Basic API Test Suite ===")
+        logger.info("=============================================")
+
+        # Generate a unique ID for this test run; nanoseconds plus PID so runs started in the same second
+        # (or in parallel) never share a session
+        conversation_id = f"basic_test_{time.time_ns()}_{os.getpid()}"
+        logger.info(f"Using Conversation ID: {conversation_id}")
+
+        # --- Test 1: Implicit Start & Print ---
+        # Runs on its own: it creates the session every later step uses
+        logger.info("\n--- Test Step 1: Implicit Start & Print ---")
+        logger.info("Purpose: Verify first /run call creates a session and executes simple print.")
+        await run_code(client, conversation_id, 'message = "Hello World!"; print(message)', check_only=True)
+
+        # --- Tests 2-4 are independent of each other: the step-2 chain runs concurrently with a batch of 3 and 4 ---
+        logger.info("\n--- Test Step 2: Variable Persistence ---")
+        logger.info("Purpose: Verify variables set in one /run call persist to the next.")
+        logger.info("\n--- Test Step 3: Dependency Installation (using 'pip') ---")
+        logger.info("Purpose: Verify the API handles the 'dependencies' list (installing pip itself).")
+        logger.info("\n--- Test Step 4: Execution Error Handling ---")
+        logger.info("Purpose: Verify kernel errors (like NameError) are caught and returned (expecting 400).")
+        await asyncio.gather(
+            _step_variable_persistence(client, conversation_id),
+            run_code_batch(client, conversation_id, [
+                # Installing 'pip' is usually safe and quick, testing the mechanism.
+                {"code": 'print("Dependency installation step completed.")', "dependencies": ["pip"]},
+                {"code": 'print(non_existent_variable)', "expected_status": 400},
+            ]),
+        )
+
+        # --- Test 5: Reset Session ---
+        logger.info("\n--- Test Step 5: Reset Session ---")
+        logger.info("Purpose: Verify the /reset endpoint successfully resets the kernel.")
+        await reset_session(client, conversation_id)
+
+        # --- Test 6: Verify State After Reset ---
+        logger.info("\n--- Test Step 6: Verify State After Reset ---")
+        logger.info("Purpose: Check that variables are cleared after reset (expecting 400 for NameError).")
+        logger.info("Purpose: Check that the kernel is still usable after reset.")
+        await run_code_batch(client, conversation_id, [
+            {"code": 'print(f"Value of a after reset: {a}")', "expected_status": 400},
+            {"code": 'print("Kernel is responsive after reset.")'},
+        ])
+
+        # --- Test 7: End Session ---
+        logger.info("\n--- Test Step 7: End Session ---")
+        logger.info("Purpose: Verify the /end_session endpoint successfully terminates the session.")
+        await end_session(client, conversation_id)
+
+        # --- Test 8: Verify State After End ---
+        logger.info("\n--- Test Step 8: Verify State After End ---")
+        # Sequential: /run re-creates an unknown session, so it must come after the /reset check
+        logger.info("Purpose: Check that /reset fails with 404 for the ended session ID.")
+        await reset_session(client, conversation_id, expected_status=404)
+        logger.info("Purpose: Check that /run re-creates a fresh session for the ended session ID.")
+        await run_code(client, conversation_id, 'print("Session re-created after end.")', check_only=True)
+        await end_session(client, conversation_id) # Don't leave the re-created session behind
+
+    logger.info("\n=============================================")
+    logger.info(f"=== Test Suite Finished for ID: {conversation_id} ===")
+    logger.info("=============================================")
+
+if __name__ == "__main__":
+    # Only the suite's own logger writes to stdout; httpx's per-request INFO records stay off
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+    asyncio.run(main())
 
 
 """
-Example Expected Output Structure:
+Example Expected Output Structure (with APITEST_VERBOSE=1; without it successful bodies are omitted, and the
+concurrent calls of steps 2-4 may be logged in a different order):
 
 =============================================
 === Starting Basic API Test Suite ===
 =============================================
-Using Conversation ID: basic_test_17XXXXXXXXX
+Using Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
 
 --- Test Step 1: Implicit Start & Print ---
 Purpose: Verify first /run call creates a session and executes simple print.
 
 >>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
     Dependencies:    None
     Code Snippet:    message = "Hello World!"; print(message)
     Expected Status: 200
@@ -223,8 +371,14 @@ Purpose: Verify first /run call creates a session and executes simple print.
 --- Test Step 2: Variable Persistence ---
 Purpose: Verify variables set in one /run call persist to the next.
 
+--- Test Step 3: Dependency Installation (using 'pip') ---
+Purpose: Verify the API handles the 'dependencies' list (installing pip itself).
+
+--- Test Step 4: Execution Error Handling ---
+Purpose: Verify kernel errors (like NameError) are caught and returned (expecting 400).
+
 >>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
     Dependencies:    None
     Code Snippet:    a = 10; b = 20
     Expected Status: 200
@@ -236,45 +390,23 @@ Purpose: Verify variables set in one /run call persist to the next.
   "output": ""
 }
 
->>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
-    Dependencies:    None
-    Code Snippet:    c = a + b; print(f"Result of a+b: {c}")
-    Expected Status: 200
-<<< Response from /run
-    Status Code: 200
-    Result: SUCCESS (Status code matches expected)
-    Response Body:
-{
-  "output": "Result of a+b: 30"
-}
-
---- Test Step 3: Dependency Installation (using 'pip') ---
-Purpose: Verify the API handles the 'dependencies' list (installing pip itself).
-
->>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
-    Dependencies:    ['pip']
-    Code Snippet:    print("Dependency installation step completed.")
-    Expected Status: 200
-<<< Response from /run
+>>> Calling /run_batch (2 items)
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
+    - Dependencies:    ['pip']
+      Code Snippet:    print("Dependency installation step completed.")
+      Expected Status: 200
+    - Dependencies:    None
+      Code Snippet:    print(non_existent_variable)
+      Expected Status: 400
+<<< Response from /run_batch
     Status Code: 200
+    Item 1 Status Code: 200
     Result: SUCCESS (Status code matches expected)
     Response Body:
 {
   "output": "Dependency installation step completed."
 }
-
---- Test Step 4: Execution Error Handling ---
-Purpose: Verify kernel errors (like NameError) are caught and returned (expecting 400).
-
->>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
-    Dependencies:    None
-    Code Snippet:    print(non_existent_variable)
-    Expected Status: 400
-<<< Response from /run
-    Status Code: 400
+    Item 2 Status Code: 400
     Result: SUCCESS (Status code matches expected)
     Error Body:
 {
@@ -286,30 +418,48 @@ Purpose: Verify kernel errors (like NameError) are caught and returned (expectin
   }
 }
 
+>>> Calling /run
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
+    Dependencies:    None
+    Code Snippet:    c = a + b; print(f"Result of a+b: {c}")
+    Expected Status: 200
+<<< Response from /run
+    Status Code: 200
+    Result: SUCCESS (Status code matches expected)
+    Response Body:
+{
+  "output": "Result of a+b: 30"
+}
+
 --- Test Step 5: Reset Session ---
 Purpose: Verify the /reset endpoint successfully resets the kernel.
 
 >>> Calling /reset
-    Conversation ID: basic_test_17XXXXXXXXX
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
     Expected Status: 200
 <<< Response from /reset
     Status Code: 200
     Result: SUCCESS (Status code matches expected)
     Response Body:
 {
-  "message": "Kernel for session 'basic_test_17XXXXXXXXX' reset successful"
+  "message": "Kernel for session 'basic_test_17XXXXXXXXXXXXXXXXXX_PID' reset successful"
 }
 
 --- Test Step 6: Verify State After Reset ---
 Purpose: Check that variables are cleared after reset (expecting 400 for NameError).
+Purpose: Check that the kernel is still usable after reset.
 
->>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
-    Dependencies:    None
-    Code Snippet:    print(f"Value of a after reset: {a}")
-    Expected Status: 400
-<<< Response from /run
-    Status Code: 400
+>>> Calling /run_batch (2 items)
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
+    - Dependencies:    None
+      Code Snippet:    print(f"Value of a after reset: {a}")
+      Expected Status: 400
+    - Dependencies:    None
+      Code Snippet:    print("Kernel is responsive after reset.")
+      Expected Status: 200
+<<< Response from /run_batch
+    Status Code: 200
+    Item 1 Status Code: 400
     Result: SUCCESS (Status code matches expected)
     Error Body:
 {
@@ -320,15 +470,7 @@ Purpose: Check that variables are cleared after reset (expecting 400 for NameErr
     "traceback": [ ... traceback lines ... ]
   }
 }
-Purpose: Check that the kernel is still usable after reset.
-
->>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
-    Dependencies:    None
-    Code Snippet:    print("Kernel is responsive after reset.")
-    Expected Status: 200
-<<< Response from /run
-    Status Code: 200
+    Item 2 Status Code: 200
     Result: SUCCESS (Status code matches expected)
     Response Body:
 {
@@ -339,45 +481,56 @@ Purpose: Check that the kernel is still usable after reset.
 Purpose: Verify the /end_session endpoint successfully terminates the session.
 
 >>> Calling /end_session
-    Conversation ID: basic_test_17XXXXXXXXX
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
     Expected Status: 200
 <<< Response from /end_session
     Status Code: 200
     Result: SUCCESS (Status code matches expected)
     Response Body:
 {
-  "message": "Session 'basic_test_17XXXXXXXXX' ended successfully and cleanup initiated."
+  "message": "Session 'basic_test_17XXXXXXXXXXXXXXXXXX_PID' ended successfully and cleanup initiated."
 }
 
 --- Test Step 8: Verify State After End ---
-Purpose: Check that /run fails with 404 for the ended session ID.
+Purpose: Check that /reset fails with 404 for the ended session ID.
+
+>>> Calling /reset
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
+    Expected Status: 404
+<<< Response from /reset
+    Status Code: 404
+    Result: SUCCESS (Status code matches expected)
+    Response Body:
+{
+  "detail": "Session 'basic_test_17XXXXXXXXXXXXXXXXXX_PID' not found. Please start a new session or check the ID."
+}
+Purpose: Check that /run re-creates a fresh session for the ended session ID.
 
 >>> Calling /run
-    Conversation ID: basic_test_17XXXXXXXXX
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
     Dependencies:    None
-    Code Snippet:    print("This should not execute.")
-    Expected Status: 404
+    Code Snippet:    print("Session re-created after end.")
+    Expected Status: 200
 <<< Response from /run
-    Status Code: 404
+    Status Code: 200
     Result: SUCCESS (Status code matches expected)
-    Error Body:
+    Response Body:
 {
-  "detail": "Session 'basic_test_17XXXXXXXXX' not found. Please start a new session or check the ID."
+  "output": "Session re-created after end."
 }
-Purpose: Check that /reset fails with 404 for the ended session ID.
 
->>> Calling /reset
-    Conversation ID: basic_test_17XXXXXXXXX
-    Expected Status: 404
-<<< Response from /reset
-    Status Code: 404
+>>> Calling /end_session
+    Conversation ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID
+    Expected Status: 200
+<<< Response from /end_session
+    Status Code: 200
     Result: SUCCESS (Status code matches expected)
-    Error Body:
+    Response Body:
 {
-  "detail": "Session 'basic_test_17XXXXXXXXX' not found. Please start a new session or check the ID."
+  "message": "Session 'basic_test_17XXXXXXXXXXXXXXXXXX_PID' ended successfully and cleanup initiated."
 }
 
 =============================================
-=== Test Suite Finished for ID: basic_test_17XXXXXXXXX ===
+=== Test Suite Finished for ID: basic_test_17XXXXXXXXXXXXXXXXXX_PID ===
 =============================================
 """
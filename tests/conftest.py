@@ -0,0 +1,41 @@
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+
+import test_api
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Runs a coroutine to completion on one event loop shared by the whole (per-worker) test session."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def client(run):
+    """Shared keep-alive AsyncClient for the API; skips every test when the server is not reachable."""
+    client = httpx.AsyncClient(base_url=test_api.BASE_URL, limits=test_api.CLIENT_LIMITS, timeout=test_api.TIMEOUTS[test_api.RUN_URL])
+    try:
+        # Also warms the pooled connection before the first test; any non-2xx means this is not our server
+        run(client.get(test_api.HEALTH_URL, timeout=test_api.TIMEOUTS[test_api.HEALTH_URL])).raise_for_status()
+    except httpx.HTTPError as e:
+        run(client.aclose())
+        pytest.skip(f"API server not reachable at {test_api.BASE_URL}: {e}")
+    yield client
+    run(client.aclose())
+
+
+@pytest.fixture
+def conversation_id(request, run, client):
+    """Unique session ID per test (and per xdist worker); the session is ended afterwards if it still exists."""
+    conversation_id = f"pytest_{request.node.name}_{os.getpid()}_{time.time_ns()}"
+    yield conversation_id
+    try:
+        run(client.post(test_api.END_URL, json={"conversation_id": conversation_id}, timeout=test_api.TIMEOUTS[test_api.END_URL]))
+    except httpx.HTTPError:
+        pass # Server went away during the test; the test itself reports that
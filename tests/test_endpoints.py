@@ -0,0 +1,61 @@
+import gzip
+
+import test_api
+from test_api import loads, run_code_batch
+
+
+def test_health(run, client):
+    response = run(client.get(test_api.HEALTH_URL, timeout=test_api.TIMEOUTS[test_api.HEALTH_URL]))
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+
+def test_run_batch(run, client, conversation_id):
+    # Items run in order in one session, and a failing item does not stop the ones after it.
+    results = run(run_code_batch(client, conversation_id, [
+        {"code": 'x = 5'},
+        {"code": 'print(undefined_in_batch)', "expected_status": 400},
+        {"code": 'print(x * 2)'},
+    ]))
+    assert results[0] == {"output": ""}
+    assert results[1]["detail"]["ename"] == "NameError"
+    assert results[2] == {"output": "10"}
+
+
+def test_run_stream(run, client, conversation_id):
+    async def stream(code):
+        payload = {"conversation_id": conversation_id, "code": code}
+        async with client.stream("POST", test_api.RUN_URL, params={"stream": "true"}, json=payload) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/x-ndjson"
+            return [loads(line) async for line in response.aiter_lines() if line]
+
+    lines = run(stream('for i in range(3): print(i, flush=True)'))
+    assert "".join(line["output"] for line in lines) == "0\n1\n2\n"
+    # Errors arrive in-band once the stream has started
+    lines = run(stream('print("before"); raise ValueError("boom")'))
+    assert lines[0] == {"output": "before\n"}
+    assert lines[-1]["status_code"] == 400
+    assert lines[-1]["error"]["ename"] == "ValueError"
+
+
+def test_gzip_bodies(run, client, conversation_id):
+    # The padding pushes the request over GZIP_MIN_SIZE and the printed output over the server's minimum_size.
+    code = f'# {"x" * test_api.GZIP_MIN_SIZE}\nprint("y" * 2000)'
+    response = run(test_api._send(client, test_api.RUN_URL, {"conversation_id": conversation_id, "code": code}, test_api.TIMEOUTS[test_api.RUN_URL]))
+    assert response.request.headers["content-encoding"] == "gzip"
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == {"output": "y" * 2000}
+
+
+def test_invalid_gzip_body(run, client):
+    response = run(client.post(test_api.RUN_URL, content=b"not gzip", headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}))
+    assert response.status_code == 400
+
+
+def test_oversized_gzip_body(run, client):
+    # 17 MiB of spaces compress to a few KB but decompress past the server's 16 MiB limit.
+    body = gzip.compress(b" " * (17 * 1024 * 1024))
+    response = run(client.post(test_api.RUN_URL, content=body, headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}))
+    assert response.status_code == 413
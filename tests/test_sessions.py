@@ -0,0 +1,42 @@
+from test_api import end_session, reset_session, run_code
+
+
+def test_persistence(run, client, conversation_id):
+    assert run(run_code(client, conversation_id, 'a = 10; b = 20', check_only=True))
+    result = run(run_code(client, conversation_id, 'c = a + b; print(f"Result of a+b: {c}")'))
+    assert result["output"] == "Result of a+b: 30"
+
+
+def test_dependency_install(run, client, conversation_id):
+    # Installing 'pip' is usually safe and quick, testing the mechanism.
+    result = run(run_code(client, conversation_id, 'print("Dependency installation step completed.")', dependencies=["pip"]))
+    assert result["output"] == "Dependency installation step completed."
+
+
+def test_error_handling(run, client, conversation_id):
+    result = run(run_code(client, conversation_id, 'print(non_existent_variable)', expected_status=400))
+    assert result["detail"]["ename"] == "NameError"
+
+
+def test_reset_flow(run, client, conversation_id):
+    assert run(run_code(client, conversation_id, 'a = 10', check_only=True))
+    assert run(reset_session(client, conversation_id))
+    result = run(run_code(client, conversation_id, 'print(f"Value of a after reset: {a}")', expected_status=400))
+    assert result["detail"]["evalue"] == "name 'a' is not defined"
+    result = run(run_code(client, conversation_id, 'print("Kernel is responsive after reset.")'))
+    assert result["output"] == "Kernel is responsive after reset."
+
+
+def test_dependencies_after_reset(run, client, conversation_id):
+    # A reset wipes the imports, so the same dependencies must be imported again rather than skipped.
+    assert run(run_code(client, conversation_id, 'pass', dependencies=["pip"], check_only=True))
+    assert run(reset_session(client, conversation_id))
+    result = run(run_code(client, conversation_id, 'print(pip.__name__)', dependencies=["pip"]))
+    assert result["output"] == "pip"
+
+
+def test_end_session_flow(run, client, conversation_id):
+    assert run(run_code(client, conversation_id, 'print("started")', check_only=True))
+    assert run(end_session(client, conversation_id))
+    assert run(reset_session(client, conversation_id, expected_status=404))
+    assert run(end_session(client, conversation_id, expected_status=404))